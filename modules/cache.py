@@ -0,0 +1,74 @@
+"""
+Small in-process cache for the polled list endpoints.
+"""
+
+import time
+import threading
+
+
+class SWRCache:
+    """TTL cache with stale-while-revalidate semantics.
+    
+    Entries younger than ttl_soft are returned as-is. Entries between ttl_soft
+    and ttl_hard are returned immediately while a background refresh runs.
+    Older (or missing) entries are fetched synchronously. Refreshes run through
+    start_task (e.g. socketio.start_background_task) so they follow the
+    server's async mode.
+    """
+    
+    def __init__(self, start_task, ttl_soft=2.0, ttl_hard=30.0):
+        self.start_task = start_task
+        self.ttl_soft = ttl_soft
+        self.ttl_hard = ttl_hard
+        self._entries = {}  # key -> (value, fetched_at, generation)
+        self._refreshing = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key, fetch):
+        """Return the cached value for key, calling fetch() when needed."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at, _ = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl_soft:
+                return value
+            if age < self.ttl_hard:
+                self._refresh_async(key, fetch)
+                return value
+        return self._fetch(key, fetch)
+    
+    def _fetch(self, key, fetch):
+        """Fetch a value and store it unless the cache was invalidated meanwhile."""
+        generation = self._generation
+        value = fetch()
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (value, time.monotonic(), generation)
+        return value
+    
+    def _refresh_async(self, key, fetch):
+        """Refresh key in a background task (at most one refresh per key)."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        
+        def refresh():
+            try:
+                self._fetch(key, fetch)
+            except Exception as e:
+                print(f"Warning: Cache refresh failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        
+        self.start_task(refresh)
+    
+    def invalidate(self, name):
+        """Drop every entry whose key is name or a tuple starting with name."""
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                if key == name or (isinstance(key, tuple) and key[0] == name):
+                    del self._entries[key]
@@ -3,37 +3,53 @@ Custom commands management for quick command buttons.
 """
 
 import os
-import json
+import copy
+from types import MappingProxyType
+
+from . import jsonio
 
 
 class CommandsManager:
     """Manages custom quick commands per session."""
     
+    # Mutations within this window are written to disk together
+    SAVE_DELAY = 0.25
+    
     def __init__(self, commands_file='commands.json'):
         self.commands_file = commands_file
         self._commands = self._load()
+        self._commands_view = MappingProxyType(self._commands)
+        self._json_cache = None
+        self._writer = jsonio.DebouncedWriter(commands_file, lambda: self._commands,
+                                              delay=self.SAVE_DELAY, label='commands')
     
     def _load(self):
         """Load commands from file."""
         if os.path.exists(self.commands_file):
             try:
-                with open(self.commands_file, 'r') as f:
-                    return json.load(f)
+                return copy.deepcopy(jsonio.load_file(self.commands_file))
             except:
                 pass
         return {}
     
     def _save(self):
-        """Save commands to file."""
-        try:
-            with open(self.commands_file, 'w') as f:
-                json.dump(self._commands, f, indent=2)
-        except Exception as e:
-            print(f"Warning: Could not save commands: {e}")
+        """Schedule a debounced save of commands to file."""
+        self._json_cache = None
+        self._writer.schedule()
+    
+    def flush(self):
+        """Write pending changes to file immediately."""
+        self._writer.flush()
     
     def get_all(self):
-        """Get all commands for all sessions."""
-        return self._commands.copy()
+        """Get a read-only view of all commands for all sessions."""
+        return self._commands_view
+    
+    def get_all_json(self):
+        """Get all commands serialized as JSON bytes (cached until the next change)."""
+        if self._json_cache is None:
+            self._json_cache = jsonio.dumps(self._commands)
+        return self._json_cache
     
     def get(self, session):
         """Get commands for a session."""
@@ -3,9 +3,10 @@ Configuration management for Tmux Control Panel.
 """
 
 import os
-import json
 from pathlib import Path
 
+from . import jsonio
+
 DEFAULT_CONFIG = {
     'tmux_socket': 'control-panel',
     'session_prefix': 'cp-',
@@ -20,28 +21,33 @@ DEFAULT_CONFIG = {
 class Config:
     """Manages application configuration."""
     
+    # Setter storms within this window are written to disk together
+    SAVE_DELAY = 0.25
+    
     def __init__(self, config_file='config.json'):
         self.config_file = config_file
         self._config = DEFAULT_CONFIG.copy()
+        self._json = None  # encoded snapshot of _config, rebuilt after changes
+        self._writer = jsonio.DebouncedWriter(config_file, lambda: self._config,
+                                              delay=self.SAVE_DELAY, label='config')
         self._load()
     
     def _load(self):
         """Load configuration from file."""
         if os.path.exists(self.config_file):
             try:
-                with open(self.config_file, 'r') as f:
-                    loaded = json.load(f)
-                    self._config.update(loaded)
+                self._config.update(jsonio.load_file(self.config_file))
             except Exception as e:
                 print(f"Warning: Could not load config: {e}")
     
     def save(self):
-        """Save configuration to file."""
-        try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self._config, f, indent=2)
-        except Exception as e:
-            print(f"Warning: Could not save config: {e}")
+        """Schedule a debounced save of configuration to file."""
+        self._json = None
+        self._writer.schedule()
+    
+    def flush(self):
+        """Write pending configuration changes to file immediately."""
+        self._writer.flush()
     
     @property
     def tmux_socket(self):
@@ -85,6 +91,12 @@ class Config:
         """Return config as dictionary."""
         return self._config.copy()
     
+    def to_json(self):
+        """Return config as encoded JSON bytes (cached until the next change)."""
+        if self._json is None:
+            self._json = jsonio.dumps(self._config)
+        return self._json
+    
     def update(self, **kwargs):
         """Update multiple config values."""
         for key, value in kwargs.items():
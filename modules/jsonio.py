@@ -0,0 +1,98 @@
+"""
+JSON file helpers shared by the config and commands stores.
+
+Uses orjson when it is installed and falls back to the stdlib json module.
+"""
+
+import os
+import json
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# path -> (mtime_ns, size, parsed) for files that have already been parsed
+_parse_cache = {}
+
+
+def loads(data):
+    """Parse JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=False):
+    """Serialize obj to JSON bytes."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, indent=2).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def load_file(path):
+    """Load a JSON file, reusing the previous parse if the file is unchanged.
+    
+    The returned object is shared with the cache and must not be mutated.
+    """
+    st = os.stat(path)
+    cached = _parse_cache.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    with open(path, 'rb') as f:
+        parsed = loads(f.read())
+    _parse_cache[path] = (st.st_mtime_ns, st.st_size, parsed)
+    return parsed
+
+
+def save_file(path, obj):
+    """Atomically write obj to a JSON file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(dumps(obj, indent=True))
+    os.replace(tmp_path, path)
+    _parse_cache.pop(path, None)
+
+
+class DebouncedWriter:
+    """Coalesces repeated saves of a JSON file into a single delayed write."""
+    
+    def __init__(self, path, get_data, delay=0.25, label='file'):
+        self.path = path
+        self.get_data = get_data
+        self.delay = delay
+        self.label = label
+        self._lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+    
+    def schedule(self):
+        """Mark the data dirty and (re)start the write-back timer."""
+        with self._lock:
+            self._dirty = True
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def flush(self):
+        """Write pending changes immediately."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            try:
+                save_file(self.path, self.get_data())
+            except Exception as e:
+                print(f"Warning: Could not save {self.label}: {e}")
@@ -3,16 +3,65 @@ PTY (Pseudo-terminal) management for tmux sessions.
 """
 
 import os
-import pty
 import fcntl
 import struct
 import termios
 import signal
 import select
+import selectors
 import threading
 import time
 import errno
 import re
+import collections
+import heapq
+
+# Prefer RE2 (linear-time DFA matching) for the output filter when available
+try:
+    import re2 as fast_re
+except ImportError:
+    fast_re = re
+
+# struct winsize for TIOCSWINSZ: rows, cols, xpixel, ypixel
+WINSIZE = struct.Struct("HHHH")
+
+
+class PtyConnection:
+    """State for one PTY attached to a tmux session."""
+    
+    __slots__ = (
+        'full_name', 'master_fd', 'pid', 'socket', 'clients', 'last_size',
+        'stop_event', 'write_queue', 'write_event', 'writer_thread',
+        'reader_stopped', 'writer_stopped', 'filter_escapes', 'paused', 'fd_users',
+    )
+    
+    def __init__(self, full_name, master_fd, pid, socket, sid, cols, rows, filter_escapes=True):
+        self.full_name = full_name
+        self.master_fd = master_fd
+        self.pid = pid
+        self.socket = socket
+        self.clients = {sid}
+        self.last_size = (cols, rows)
+        self.stop_event = threading.Event()
+        self.write_queue = collections.deque()
+        self.write_event = threading.Event()
+        self.writer_thread = None
+        self.reader_stopped = False
+        self.writer_stopped = False
+        self.filter_escapes = filter_escapes
+        self.paused = False  # PTY unregistered until slow clients catch up
+        self.fd_users = 2  # Reader and writer; the last to let go closes master_fd
+
+
+class ClientOutbox:
+    """Output waiting for one flow-controlled client to acknowledge its last frame."""
+    
+    __slots__ = ('pending', 'pending_bytes', 'in_flight')
+    
+    def __init__(self):
+        self.pending = {}  # full_name -> bytearray, in arrival order
+        self.pending_bytes = 0
+        self.in_flight = False
 
 
 class PtyManager:
@@ -40,139 +89,531 @@ class PtyManager:
         r'\x1bP[^\x1b]*\x1b\\'       # DCS ... ST
     )
     
+    # Both filters combined so raw output bytes are scanned in a single pass
+    ESC_PATTERN = fast_re.compile(
+        f'(?:{OSC_PATTERN.pattern})|(?:{DCS_PATTERN.pattern})'.encode()
+    )
+    
+    # Output batching: drain the PTY in large reads and emit once per burst
+    READ_SIZE = 65536                # Bytes per os.read() call
+    OUTPUT_HIGH_WATER = 1024 * 1024  # Max bytes coalesced into one emit
+    OUTPUT_COALESCE_DELAY = 0.008    # Seconds to wait for a burst to settle
+    
+    # Input batching: queued keystrokes are flushed with a single writev()
+    WRITE_MAX_IOV = 1024             # Max buffers per writev() call (IOV_MAX)
+    
+    # Flow-controlled clients: stop reading a PTY while one of its clients has
+    # more than CLIENT_BACKLOG_HIGH bytes unsent, resume below CLIENT_BACKLOG_LOW
+    CLIENT_BACKLOG_HIGH = 4 * 1024 * 1024
+    CLIENT_BACKLOG_LOW = 1024 * 1024
+    
+    # Max seconds to wait for tmux's first output after attaching
+    ATTACH_TIMEOUT = 0.2
+    
+    # Seconds a connection is kept alive after its last client leaves
+    CLEANUP_DELAY = 5
+    
+    # Resize requests arriving within this window are collapsed into one
+    RESIZE_DEBOUNCE = 0.05
+    
     def __init__(self, tmux_manager, socketio):
         self.tmux_mgr = tmux_manager
         self.socketio = socketio
         self.connections = {}  # session_name -> connection info
+        self._pending_resizes = {}  # full_name -> (cols, rows, socket)
+        self._unfiltered = set()  # sessions whose output bypasses the escape filter
+        self._outboxes = {}  # sid -> ClientOutbox for clients that acknowledge output
+        self._sid_sessions = {}  # sid -> full names it is subscribed to (for disconnect)
+        self._paused = set()  # PtyConnections held back by a slow client (under _outbox_lock)
+        self._outbox_lock = threading.Lock()
+        self._closing = []  # Cleaned-up connections the reader still has to let go of
+        self._fd_lock = threading.Lock()
+        
+        # Environment for attached tmux clients, built once instead of per spawn
+        self._child_env = os.environ.copy()
+        self._child_env['TERM'] = 'xterm-256color'
+        # Disable color queries that cause issues
+        self._child_env.pop('COLORFGBG', None)
+        
+        # One selector and reader task serve every PTY. Started through socketio so
+        # it runs on the server's event loop (a greenlet under eventlet/gevent).
+        self._selector = selectors.DefaultSelector()
+        # Reads are serialized on the reader task, so every PTY shares one buffer
+        self._read_buf = bytearray(self.OUTPUT_HIGH_WATER)
+        # Exited attach clients without a pidfd, reaped on the reader's idle ticks
+        self._unreaped = set()
+        # Self-pipe that wakes the reader when the fd set changes, so it can block
+        # without a timeout while every PTY is idle
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._reader_thread = self.socketio.start_background_task(self._reader_loop)
+        
+        # Deferred cleanups: heap of (deadline, full_name) served by one task
+        self._cleanup_queue = []
+        self._cleanup_lock = threading.Lock()
+        self._cleanup_event = threading.Event()
+        self._cleanup_thread = self.socketio.start_background_task(self._cleanup_loop)
+    
+    def _full_name(self, session_name):
+        """Resolve the prefixed session name (memoized by TmuxManager)."""
+        return self.tmux_mgr.get_full_name(session_name)
     
     def _filter_escape_sequences(self, data):
-        """Filter out problematic escape sequences from terminal output."""
-        # Filter OSC sequences (color queries, clipboard, etc.)
-        data = self.OSC_PATTERN.sub('', data)
-        # Filter DCS sequences
-        data = self.DCS_PATTERN.sub('', data)
-        return data
+        """Filter out problematic escape sequences from raw terminal output."""
+        # Filter OSC (color queries, clipboard, etc.) and DCS sequences
+        return self.ESC_PATTERN.sub(b'', data)
     
     def _set_winsize(self, fd, rows, cols):
         """Set terminal window size."""
-        winsize = struct.pack("HHHH", rows, cols, 0, 0)
-        fcntl.ioctl(fd, termios.TIOCSWINSZ, winsize)
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, WINSIZE.pack(rows, cols, 0, 0))
+    
+    def _drain(self, fd, buf):
+        """Read everything currently available from fd into buf (up to its size).
+        
+        Returns (data, eof) where eof is True once the PTY has closed. Reads land
+        directly in the reader's reusable buffer; data is copied out once.
+        """
+        view = memoryview(buf)
+        size = 0
+        eof = False
+        while size < len(buf):
+            want = min(self.READ_SIZE, len(buf) - size)
+            try:
+                n = os.readv(fd, [view[size:size + want]])
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno in (errno.EIO, errno.EBADF):
+                    eof = True
+                    break
+                raise
+            if not n:
+                eof = True
+                break
+            size += n
+            # A short read means the PTY is drained; skip the read that would
+            # only fail with EAGAIN. Anything arriving later re-arms the selector.
+            if n < want:
+                break
+        return bytes(view[:size]), eof
+    
+    def _open_pty(self):
+        """Open a pty pair and return (master_fd, slave_fd, slave_path).
+        
+        The master is non-blocking. Python 3.13+ exposes posix_openpt(), which
+        sets O_NONBLOCK at open time; older versions use openpty() plus fcntl.
+        Both fds are non-inheritable.
+        """
+        if hasattr(os, 'posix_openpt'):
+            master_fd = os.posix_openpt(os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+            try:
+                os.grantpt(master_fd)
+                os.unlockpt(master_fd)
+                slave_path = os.ptsname(master_fd)
+                slave_fd = os.open(slave_path, os.O_RDWR | os.O_NOCTTY)
+            except BaseException:
+                os.close(master_fd)
+                raise
+            return master_fd, slave_fd, slave_path
+        
+        master_fd, slave_fd = os.openpty()
+        flags = fcntl.fcntl(master_fd, fcntl.F_GETFL)
+        fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        return master_fd, slave_fd, os.ttyname(slave_fd)
     
     def _spawn_pty(self, session_name, cols=120, rows=40, socket=None):
         """Spawn a PTY that attaches to a tmux session."""
-        full_name = self.tmux_mgr.get_full_name(session_name)
+        full_name = self._full_name(session_name)
         socket = socket or self.tmux_mgr.config.tmux_socket
         
-        # Resize tmux before attaching
+        master_fd, slave_fd, slave_path = self._open_pty()
+        try:
+            self._set_winsize(master_fd, rows, cols)
+            argv = ['tmux', '-L', socket, 'attach', '-t', full_name]
+            # posix_spawn avoids duplicating the server's page tables like fork()
+            # does. The child starts a new session and reopens the slave so it
+            # becomes its controlling terminal (needed for SIGWINCH on resize).
+            # Both pty fds are non-inheritable, so the child only sees stdio.
+            try:
+                pid = os.posix_spawnp('tmux', argv, self._child_env, setsid=True, file_actions=[
+                    (os.POSIX_SPAWN_OPEN, 0, slave_path, os.O_RDWR, 0),
+                    (os.POSIX_SPAWN_DUP2, 0, 1),
+                    (os.POSIX_SPAWN_DUP2, 0, 2),
+                ])
+            except NotImplementedError:
+                # libc without POSIX_SPAWN_SETSID
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        os.setsid()
+                        tty_fd = os.open(slave_path, os.O_RDWR)
+                        for fd in (0, 1, 2):
+                            os.dup2(tty_fd, fd)
+                        os.execvpe('tmux', argv, self._child_env)
+                    finally:
+                        os._exit(127)
+        except BaseException:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        
+        # Wait until tmux draws its first output (attach done) instead of sleeping
+        select.select([master_fd], [], [], self.ATTACH_TIMEOUT)
         self.tmux_mgr.resize_window(full_name, cols, rows, socket=socket)
-        time.sleep(0.05)
         
-        pid, master_fd = pty.fork()
+        return master_fd, pid
+    
+    def _reader_loop(self):
+        """Read from every PTY in one thread and emit output to WebSocket rooms."""
+        while True:
+            # Connections cleaned up during the last batch can't be in use any more
+            if self._closing:
+                self._release_closing()
+            # Only children without a pidfd need a periodic tick
+            timeout = 1.0 if self._unreaped else None
+            try:
+                events = self._selector.select(timeout=timeout)
+            except (ValueError, OSError) as e:
+                print(f"PTY selector error: {e}")
+                time.sleep(0.1)
+                continue
+            if not events:
+                if self._unreaped:
+                    self._reap_unreaped()
+                continue
+            # Give bursts a moment to settle so each session's output goes out as one
+            # frame (wakeup and pidfd events carry no output, so don't delay them)
+            if any(isinstance(key.data, PtyConnection) for key, _ in events):
+                self.socketio.sleep(self.OUTPUT_COALESCE_DELAY)
+            for key, _ in events:
+                if isinstance(key.data, PtyConnection):
+                    self._read_output(key.data)
+                    # Let the hub flush this frame and serve handlers (input,
+                    # resize) before draining the next busy session
+                    self.socketio.sleep(0)
+                elif key.data is None:
+                    self._clear_wakeup()
+                else:
+                    self._reap(key.fd, key.data)
+    
+    def _release_closing(self):
+        """Let go of the fds of connections removed by cleanup() (reader side)."""
+        with self._fd_lock:
+            closing, self._closing = self._closing, []
+        for conn in closing:
+            # _resume_paused() may have re-registered it just before cleanup()
+            self._unregister(conn.master_fd)
+            self._release_fd(conn)
+    
+    def _release_fd(self, conn):
+        """Drop the reader's or writer's hold on a PTY fd; the last one closes it.
         
-        if pid == 0:
-            # Child process
-            os.environ['TERM'] = 'xterm-256color'
-            # Disable color queries that cause issues
-            os.environ.pop('COLORFGBG', None)
-            os.execlp('tmux', 'tmux', '-L', socket, 'attach', '-t', full_name)
-        else:
-            # Parent process
-            flags = fcntl.fcntl(master_fd, fcntl.F_GETFL)
-            fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-            self._set_winsize(master_fd, rows, cols)
-            
-            time.sleep(0.1)
-            self.tmux_mgr.resize_window(full_name, cols, rows, socket=socket)
-            
-            return master_fd, pid
-    
-    def _start_reader(self, session_name, master_fd):
-        """Start a thread that reads from PTY and emits to WebSocket."""
-        full_name = self.tmux_mgr.get_full_name(session_name)
-        stop_event = threading.Event()
-        
-        def reader_thread():
+        Closing while the other side may still be reading or writing would let a
+        newly opened file reuse the fd number underneath it.
+        """
+        with self._fd_lock:
+            conn.fd_users -= 1
+            if conn.fd_users:
+                return
+        try:
+            os.close(conn.master_fd)
+        except OSError:
+            pass
+    
+    def _wake_reader(self):
+        """Make the reader re-enter select() with the current fd set."""
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # A wakeup is already pending
+    
+    def _clear_wakeup(self):
+        """Drain pending wakeup bytes."""
+        try:
+            while os.read(self._wakeup_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+    
+    def _read_output(self, conn):
+        """Drain one PTY and emit its output; unregister it on EOF."""
+        full_name = conn.full_name
+        master_fd = conn.master_fd
+        try:
+            data, eof = self._drain(master_fd, self._read_buf)
+            if data:
+                # Filter out problematic escape sequences (plain text has none)
+                if conn.filter_escapes and b'\x1b' in data:
+                    data = self._filter_escape_sequences(data)
+                # Only emit if there's content left and someone is listening (the
+                # room is empty while a connection waits out its cleanup delay)
+                if data and conn.clients:
+                    self._send_output(conn, data)
+        except (ValueError, OSError):
+            eof = True
+        except Exception as e:
+            print(f"PTY reader error for {full_name}: {e}")
+            eof = True
+        if eof:
+            self._unregister(master_fd)
+            conn.reader_stopped = True
+    
+    def _watch_child(self, pid):
+        """Reap an attach client from the reader task as soon as it exits.
+        
+        A pidfd becomes readable when its process exits, so the shared selector
+        reaps clients that quit on their own (e.g. the session was killed) as well
+        as ones terminated by cleanup(). Only our own pids are waited on; a
+        SIGCHLD handler with waitpid(-1) would steal exit statuses from the
+        subprocess module.
+        """
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            # No pidfd support (or the child is already gone): poll for it instead
+            self._unreaped.add(pid)
+            return
+        self._selector.register(pidfd, selectors.EVENT_READ, pid)
+    
+    def _reap(self, pidfd, pid):
+        """Collect an exited child signalled through its pidfd."""
+        self._unregister(pidfd)
+        os.close(pidfd)
+        try:
+            os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            pass
+    
+    def _reap_unreaped(self):
+        """Collect exited children that are not watched through a pidfd."""
+        for pid in list(self._unreaped):
             try:
-                while not stop_event.is_set():
-                    try:
-                        readable, _, _ = select.select([master_fd], [], [], 0.05)
-                        if readable:
-                            try:
-                                data = os.read(master_fd, 16384)
-                                if data:
-                                    decoded = data.decode('utf-8', errors='replace')
-                                    # Filter out problematic escape sequences
-                                    filtered = self._filter_escape_sequences(decoded)
-                                    if filtered:  # Only emit if there's content left
-                                        self.socketio.emit('output', {
-                                            'session': full_name,
-                                            'data': filtered
-                                        }, room=full_name)
-                                else:
-                                    break  # EOF
-                            except OSError as e:
-                                if e.errno in (errno.EIO, errno.EBADF):
-                                    break
-                                raise
-                    except (ValueError, OSError):
-                        break
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self._unreaped.discard(pid)
+    
+    def _send_output(self, conn, data):
+        """Emit PTY output to the connection's clients.
+        
+        Raw bytes go out as a binary attachment. xterm.js decodes UTF-8
+        statefully, so codepoints split across reads are reassembled there.
+        Flow-controlled clients get at most one unacknowledged frame; anything
+        read meanwhile is merged into their outbox.
+        """
+        full_name = conn.full_name
+        controlled = [sid for sid in list(conn.clients) if sid in self._outboxes]
+        if len(controlled) < len(conn.clients):
+            self.socketio.emit('output', {
+                'session': full_name,
+                'data': data
+            }, room=full_name, skip_sid=controlled or None)
+        
+        backlogged = False
+        for sid in controlled:
+            with self._outbox_lock:
+                box = self._outboxes.get(sid)
+                if box is None:
+                    continue
+                if box.in_flight:
+                    pending = box.pending.get(full_name)
+                    if pending is None:
+                        box.pending[full_name] = bytearray(data)
+                    else:
+                        pending += data
+                    box.pending_bytes += len(data)
+                    backlogged = backlogged or box.pending_bytes > self.CLIENT_BACKLOG_HIGH
+                    continue
+                box.in_flight = True
+            self._emit_to(sid, full_name, data)
+        
+        if backlogged:
+            # Let tmux absorb the slow client instead of buffering without bound.
+            # Under the lock so an ack can't resume it halfway through.
+            with self._outbox_lock:
+                if not conn.paused:
+                    conn.paused = True
+                    self._paused.add(conn)
+                    self._unregister(conn.master_fd)
+    
+    def _emit_to(self, sid, full_name, data):
+        """Send one output frame to a flow-controlled client."""
+        self.socketio.emit('output', {
+            'session': full_name,
+            'data': data
+        }, to=sid, callback=lambda *args: self._output_acked(sid))
+    
+    def _output_acked(self, sid):
+        """Send the client's next pending frame and resume PTYs it was holding up."""
+        with self._outbox_lock:
+            box = self._outboxes.get(sid)
+            if box is None:
+                return
+            if not box.pending:
+                box.in_flight = False
+                frame = None
+            else:
+                full_name = next(iter(box.pending))
+                data = box.pending.pop(full_name)
+                box.pending_bytes -= len(data)
+                frame = (full_name, bytes(data))
+        if frame is not None:
+            self._emit_to(sid, *frame)
+        self._resume_paused()
+    
+    def _resume_paused(self):
+        """Re-register paused PTYs whose clients are all below the low-water mark."""
+        if not self._paused:
+            return  # The common case on every ack
+        resumed = False
+        with self._outbox_lock:
+            for conn in list(self._paused):
+                if any(sid in self._outboxes
+                       and self._outboxes[sid].pending_bytes > self.CLIENT_BACKLOG_LOW
+                       for sid in list(conn.clients)):
+                    continue
+                conn.paused = False
+                self._paused.discard(conn)
+                if conn.reader_stopped or conn.stop_event.is_set():
+                    continue
+                try:
+                    self._selector.register(conn.master_fd, selectors.EVENT_READ, conn)
+                except (KeyError, ValueError, OSError):
+                    continue  # Already registered, or closed by cleanup() meanwhile
+                resumed = True
+        if resumed:
+            self._wake_reader()
+    
+    def enable_flow_control(self, sid):
+        """Hold further output for sid until it acknowledges each 'output' frame."""
+        with self._outbox_lock:
+            self._outboxes.setdefault(sid, ClientOutbox())
+    
+    def _drop_pending(self, full_name, sid):
+        """Forget output queued for sid from one session."""
+        with self._outbox_lock:
+            box = self._outboxes.get(sid)
+            if box is not None:
+                data = box.pending.pop(full_name, None)
+                if data is not None:
+                    box.pending_bytes -= len(data)
+    
+    def disconnect(self, sid):
+        """Remove a disconnected client from the PTY connections it joined."""
+        for full_name in self._sid_sessions.pop(sid, ()):
+            self.remove_client(full_name, sid)
+        with self._outbox_lock:
+            self._outboxes.pop(sid, None)
+        self._resume_paused()
+    
+    def _unregister(self, fd):
+        """Stop watching a PTY fd in the shared selector."""
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+    
+    def _write_chunks(self, fd, chunks):
+        """Write a list of byte chunks to fd, handling partial and blocked writes."""
+        while chunks:
+            try:
+                if len(chunks) == 1:
+                    written = os.write(fd, chunks[0])
+                else:
+                    written = os.writev(fd, chunks[:self.WRITE_MAX_IOV])
+            except BlockingIOError:
+                select.select([], [fd], [], 0.05)
+                continue
+            while written and chunks:
+                if written >= len(chunks[0]):
+                    written -= len(chunks[0])
+                    chunks.pop(0)
+                else:
+                    # Keep the unwritten tail as a view so large pastes aren't re-copied
+                    chunks[0] = memoryview(chunks[0])[written:]
+                    written = 0
+    
+    def _start_writer(self, conn):
+        """Start a thread that flushes queued input to the PTY."""
+        def writer_thread():
+            try:
+                while not conn.stop_event.is_set():
+                    # No polling timeout: cleanup() sets write_event after stop_event
+                    conn.write_event.wait()
+                    conn.write_event.clear()
+                    # Everything queued since the last flush goes out in one syscall
+                    chunks = []
+                    while conn.write_queue:
+                        chunks.append(conn.write_queue.popleft())
+                    if chunks:
+                        self._write_chunks(conn.master_fd, chunks)
+            except (ValueError, OSError):
+                pass
             except Exception as e:
-                print(f"PTY reader error for {full_name}: {e}")
+                print(f"PTY writer error for {conn.full_name}: {e}")
             finally:
-                if full_name in self.connections:
-                    self.connections[full_name]['reader_stopped'] = True
+                conn.writer_stopped = True
+                self._release_fd(conn)
         
-        thread = threading.Thread(target=reader_thread, daemon=True)
-        thread.start()
-        return thread, stop_event
+        conn.writer_thread = self.socketio.start_background_task(writer_thread)
     
     def get_or_create(self, session_name, sid, cols=120, rows=40, socket=None):
-        """Get existing PTY connection or create a new one."""
-        full_name = self.tmux_mgr.get_full_name(session_name)
+        """Get existing PTY connection or create a new one.
+        
+        Returns (conn, created); conn is None if the session does not exist. A
+        created PTY is already spawned at cols x rows.
+        """
+        full_name = self._full_name(session_name)
         
         if full_name in self.connections:
             conn = self.connections[full_name]
-            conn['clients'].add(sid)
-            if conn.get('reader_stopped', False):
+            conn.clients.add(sid)
+            if conn.reader_stopped or conn.writer_stopped:
                 self.cleanup(full_name)
             else:
-                return conn
+                self._sid_sessions.setdefault(sid, set()).add(full_name)
+                return conn, False
         
         if not self.tmux_mgr.session_exists(full_name, socket=socket):
-            return None
+            return None, False
         
         master_fd, pid = self._spawn_pty(full_name, cols, rows, socket=socket)
-        reader_thread, stop_event = self._start_reader(full_name, master_fd)
-        
-        self.connections[full_name] = {
-            'master_fd': master_fd,
-            'pid': pid,
-            'reader_thread': reader_thread,
-            'stop_event': stop_event,
-            'clients': {sid},
-            'reader_stopped': False,
-            'socket': socket or self.tmux_mgr.config.tmux_socket
-        }
-        return self.connections[full_name]
+        conn = PtyConnection(full_name, master_fd, pid,
+                             socket or self.tmux_mgr.config.tmux_socket,
+                             sid, cols, rows, filter_escapes=full_name not in self._unfiltered)
+        self.connections[full_name] = conn
+        self._start_writer(conn)
+        self._selector.register(master_fd, selectors.EVENT_READ, conn)
+        self._watch_child(pid)
+        self._wake_reader()
+        self._sid_sessions.setdefault(sid, set()).add(full_name)
+        return conn, True
     
     def cleanup(self, session_name):
         """Clean up PTY connection for a session."""
-        full_name = self.tmux_mgr.get_full_name(session_name)
+        full_name = self._full_name(session_name)
         
         if full_name not in self.connections:
             return
         
         conn = self.connections[full_name]
-        conn['stop_event'].set()
+        conn.stop_event.set()
+        conn.write_event.set()
+        self._unregister(conn.master_fd)
+        with self._outbox_lock:
+            self._paused.discard(conn)
+        # The fd is closed once the reader and the writer have both let go of it
+        with self._fd_lock:
+            self._closing.append(conn)
+        self._wake_reader()
         
+        # The reader task reaps the client once it has exited
         try:
-            os.close(conn['master_fd'])
-        except:
-            pass
-        
-        try:
-            os.kill(conn['pid'], signal.SIGTERM)
-            os.waitpid(conn['pid'], os.WNOHANG)
+            os.kill(conn.pid, signal.SIGTERM)
         except:
             pass
         
@@ -183,44 +624,121 @@ class PtyManager:
         for session_name in list(self.connections.keys()):
             self.cleanup(session_name)
     
+    def set_filter(self, session_name, enabled):
+        """Enable or disable escape-sequence filtering for a session's output."""
+        full_name = self._full_name(session_name)
+        if enabled:
+            self._unfiltered.discard(full_name)
+        else:
+            self._unfiltered.add(full_name)
+        
+        conn = self.connections.get(full_name)
+        if conn:
+            conn.filter_escapes = enabled
+    
+    def is_filtered(self, session_name):
+        """Check whether a session's output goes through the escape filter."""
+        return self._full_name(session_name) not in self._unfiltered
+    
     def remove_client(self, session_name, sid):
         """Remove a client from a PTY connection."""
-        full_name = self.tmux_mgr.get_full_name(session_name)
+        full_name = self._full_name(session_name)
+        sessions = self._sid_sessions.get(sid)
+        if sessions is not None:
+            sessions.discard(full_name)
         
         if full_name not in self.connections:
             return
         
         conn = self.connections[full_name]
-        conn['clients'].discard(sid)
+        conn.clients.discard(sid)
+        self._drop_pending(full_name, sid)
+        # The departing client may have been the backlog holding a PTY paused
+        self._resume_paused()
         
-        if not conn['clients']:
-            def delayed_cleanup():
-                time.sleep(5)
-                if full_name in self.connections and not self.connections[full_name]['clients']:
+        if not conn.clients:
+            with self._cleanup_lock:
+                heapq.heappush(self._cleanup_queue,
+                               (time.monotonic() + self.CLEANUP_DELAY, full_name))
+            self._cleanup_event.set()
+    
+    def _cleanup_loop(self):
+        """Clean up connections that still have no clients once their delay expires."""
+        while True:
+            self._cleanup_event.clear()
+            expired = []
+            with self._cleanup_lock:
+                now = time.monotonic()
+                while self._cleanup_queue and self._cleanup_queue[0][0] <= now:
+                    expired.append(heapq.heappop(self._cleanup_queue)[1])
+                timeout = self._cleanup_queue[0][0] - now if self._cleanup_queue else None
+            for full_name in expired:
+                conn = self.connections.get(full_name)
+                if conn is not None and not conn.clients:
                     self.cleanup(full_name)
-            threading.Thread(target=delayed_cleanup, daemon=True).start()
+            self._cleanup_event.wait(timeout)
+    
+    def _queue_input(self, conn, keys):
+        """Queue keystrokes for the connection's writer."""
+        conn.write_queue.append(keys.encode('utf-8'))
+        # Event.set() takes a lock; skip it while a wakeup is already pending. The
+        # writer clears the event before draining the queue, so this input is seen.
+        if not conn.write_event.is_set():
+            conn.write_event.set()
     
     def send_keys(self, session_name, keys):
         """Send keys to the PTY."""
-        full_name = self.tmux_mgr.get_full_name(session_name)
+        full_name = self._full_name(session_name)
         
-        if full_name in self.connections:
-            try:
-                os.write(self.connections[full_name]['master_fd'], keys.encode('utf-8'))
-                return True
-            except:
-                pass
+        conn = self.connections.get(full_name)
+        if conn and not conn.writer_stopped:
+            self._queue_input(conn, keys)
+            return True
         
         return self.tmux_mgr.send_keys(full_name, keys)
     
+    def send_keys_if_exists(self, session_name, keys, socket=None):
+        """Send keys through a live PTY, or via tmux reporting a missing session.
+        
+        Returns (ok, error) like TmuxManager.send_keys_if_exists.
+        """
+        full_name = self._full_name(session_name)
+        conn = self.connections.get(full_name)
+        if conn and not conn.reader_stopped and not conn.writer_stopped:
+            self._queue_input(conn, keys)
+            return True, None
+        
+        return self.tmux_mgr.send_keys_if_exists(full_name, keys, socket=socket)
+    
     def resize(self, session_name, cols, rows, socket=None):
         """Resize both the PTY and tmux session."""
-        full_name = self.tmux_mgr.get_full_name(session_name)
+        full_name = self._full_name(session_name)
         
-        if full_name in self.connections:
+        conn = self.connections.get(full_name)
+        if conn:
             try:
-                self._set_winsize(self.connections[full_name]['master_fd'], rows, cols)
+                self._set_winsize(conn.master_fd, rows, cols)
             except:
                 pass
+            # tmux already has this size; skip the resize-window round-trip
+            if conn.last_size == (cols, rows):
+                return
+            conn.last_size = (cols, rows)
         
-        self.tmux_mgr.resize_window(full_name, cols, rows, socket=socket)
\ No newline at end of file
+        self.tmux_mgr.resize_window(full_name, cols, rows, socket=socket)
+    
+    def schedule_resize(self, session_name, cols, rows, socket=None):
+        """Resize after a short delay, collapsing bursts (e.g. drag-resizing) into one."""
+        full_name = self._full_name(session_name)
+        first = full_name not in self._pending_resizes
+        self._pending_resizes[full_name] = (cols, rows, socket)
+        if first:
+            self.socketio.start_background_task(self._apply_pending_resize, full_name)
+    
+    def _apply_pending_resize(self, full_name):
+        """Apply the latest size requested for a session once the burst settles."""
+        self.socketio.sleep(self.RESIZE_DEBOUNCE)
+        pending = self._pending_resizes.pop(full_name, None)
+        if pending:
+            cols, rows, socket = pending
+            self.resize(full_name, cols, rows, socket=socket)
\ No newline at end of file
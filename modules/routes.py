@@ -7,108 +7,258 @@ Fixed Display Configuration:
   Panel 2 (GUI 3): Display :102
 """
 
-import uuid
-import signal
-from flask import request, jsonify, render_template
+import hashlib
+from types import MappingProxyType
+from secrets import token_hex
+from flask import request, jsonify, render_template, g, Response, stream_with_context
 
+from . import jsonio, schemas
+from .cache import SWRCache
 
-def register_routes(app):
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2 has no pluggable JSON provider
+    DefaultJSONProvider = None
+
+
+# Config keys that may be changed through the API
+ALLOWED_CONFIG_KEYS = frozenset({'tmux_socket', 'session_prefix'})
+
+# GUI panel indices (see the fixed display mapping above)
+VALID_PANELS = frozenset({0, 1, 2})
+
+# Session environment for GUI apps bound to a display (DISPLAY is added per request)
+GUI_ENV = MappingProxyType({
+    "GDK_BACKEND": "x11",
+    "QT_QPA_PLATFORM": "xcb",
+    "LIBGL_ALWAYS_SOFTWARE": "1",
+    "GALLIUM_DRIVER": "llvmpipe",
+    "MESA_GL_VERSION_OVERRIDE": "3.3",
+})
+GUI_ENV_UNSET = ("WAYLAND_DISPLAY",)
+
+
+if DefaultJSONProvider is not None and jsonio.orjson is not None:
+    # Accept int keys like the stdlib encoder does
+    ORJSON_OPTIONS = jsonio.orjson.OPT_NON_STR_KEYS
+    
+    class OrjsonProvider(DefaultJSONProvider):
+        """Flask JSON provider backed by orjson."""
+        
+        def dumps(self, obj, **kwargs):
+            return jsonio.orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+        
+        def loads(self, s, **kwargs):
+            return jsonio.orjson.loads(s)
+        
+        def response(self, *args, **kwargs):
+            # orjson produces bytes, so skip the str round-trip of the default provider
+            obj = self._prepare_response_obj(args, kwargs)
+            body = jsonio.orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+            return self._app.response_class(body, mimetype=self.mimetype)
+else:
+    OrjsonProvider = None
+
+
+def register_routes(app, socketio):
     """Register all REST API routes."""
     
-    def get_managers():
-        return app.config['managers']
+    if OrjsonProvider is not None:
+        app.json = OrjsonProvider(app)
+    
+    # Compact, insertion-ordered JSON: no key sorting, no pretty-printing in debug
+    app.config['JSON_SORT_KEYS'] = False
+    app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    if DefaultJSONProvider is not None:
+        app.json.sort_keys = False
+        app.json.compact = True
+    
+    # Polled list endpoints are served from here; write paths invalidate it
+    cache = SWRCache(socketio.start_background_task)
+    
+    # Managers are created once before registration; handlers close over them
+    mgrs = app.config['managers']
+    
+    def read_body(schema=None):
+        """Decode the JSON body once per request (against schema if given).
+        
+        Without a schema the raw object is returned, or {} if the body is
+        missing or not valid JSON.
+        """
+        bodies = g.setdefault('bodies', {})
+        if schema not in bodies:
+            if request.content_length == 0:
+                # Empty POST: skip reading and parsing entirely
+                bodies[schema] = schema.empty if schema is not None else {}
+            elif schema is not None:
+                bodies[schema] = schema.decode(request.get_data())
+            else:
+                bodies[schema] = request.get_json(silent=True) or {}
+        return bodies[schema]
+    
+    def stream_display_start(steps, **extra):
+        """Stream display start-up progress as server-sent events.
+        
+        Emits one {"step": ...} event per launched process, then a final event
+        with the same body the non-streaming endpoint would return.
+        """
+        def generate():
+            try:
+                while True:
+                    step = next(steps)
+                    yield f"data: {jsonio.dumps({'step': step}).decode('utf-8')}\n\n"
+            except StopIteration as done:
+                result, error = done.value
+            finally:
+                # Stops anything already launched if the client went away mid-start
+                steps.close()
+            cache.invalidate('displays')
+            if error:
+                body = {'step': 'error', 'status': 'error', 'message': error}
+            else:
+                body = {'step': 'done', 'status': 'ok', 'display': result, **extra}
+            yield f"data: {jsonio.dumps(body).decode('utf-8')}\n\n"
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    
+    def constant_response(payload, status=200):
+        """Encode a constant JSON payload once; calling the result builds a fresh Response."""
+        body = jsonio.dumps(payload)
+        return lambda: app.response_class(body, status=status, mimetype='application/json')
+    
+    OK = constant_response({'status': 'ok'})
+    DESTROY_FAILED = constant_response({'status': 'error', 'message': 'Failed to destroy session'}, 400)
+    NO_COMMAND = constant_response({'status': 'error', 'message': 'No command provided'}, 400)
+    SESSION_NOT_FOUND = constant_response({'status': 'error', 'message': 'Session not found'}, 404)
+    SEND_FAILED = constant_response({'status': 'error', 'message': 'Failed to send command'}, 400)
+    COMMAND_NOT_FOUND = constant_response({'status': 'error', 'message': 'Command not found'}, 404)
+    INVALID_PANEL = constant_response({'status': 'error', 'message': 'Invalid panel index. Must be 0, 1, or 2'}, 400)
+    NO_DISPLAY = constant_response({'status': 'none', 'message': 'Display not found'})
+    DISPLAY_NOT_FOUND = constant_response({'status': 'error', 'message': 'Display not found'}, 404)
+    DISPLAY_REQUIRED = constant_response({'status': 'error', 'message': 'display_num or panel_index required'}, 400)
+    # The panel -> display/port mapping is fixed for the life of the process
+    X11_CONFIG = jsonio.dumps({'status': 'ok', 'config': mgrs['x11'].get_fixed_config()})
+    
+    def etag_response(body):
+        """Serve pre-encoded JSON with a weak ETag, or 304 if the client already has it."""
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(hashlib.blake2b(body, digest_size=8).hexdigest(), weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    
+    def etag_json(payload):
+        return etag_response(jsonio.dumps(payload))
+    
+    @app.errorhandler(schemas.BodyError)
+    def invalid_body(e):
+        return jsonify({'status': 'error', 'message': f'Invalid request body: {e}'}), 400
+    
+    # Rendered index page and its ETag, filled on the first request
+    index_page = {}
     
     @app.route('/')
     def index():
-        return render_template('index.html')
+        if app.debug:
+            return render_template('index.html')
+        if not index_page:
+            body = render_template('index.html').encode('utf-8')
+            index_page.update(body=body, etag=hashlib.sha1(body).hexdigest())
+        response = app.response_class(index_page['body'], mimetype='text/html')
+        response.set_etag(index_page['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     
     @app.route('/api/config', methods=['GET'])
     def get_config():
-        mgrs = get_managers()
-        return jsonify(mgrs['config'].to_dict())
+        return etag_response(mgrs['config'].to_json())
     
     @app.route('/api/config', methods=['POST', 'PATCH'])
     def update_config():
-        mgrs = get_managers()
-        data = request.get_json() or {}
-        allowed = ['tmux_socket', 'session_prefix']
-        updates = {k: v for k, v in data.items() if k in allowed}
+        data = read_body()
+        updates = {k: v for k, v in data.items() if k in ALLOWED_CONFIG_KEYS}
         if updates:
             mgrs['config'].update(**updates)
+            cache.invalidate('sessions')
         return jsonify({'status': 'ok', 'config': mgrs['config'].to_dict()})
     
     @app.route('/api/sessions', methods=['GET'])
     def list_sessions():
-        mgrs = get_managers()
         socket = request.args.get('socket')
-        sessions = mgrs['tmux'].get_sessions(socket=socket)
-        return jsonify({'sessions': sessions, 'count': len(sessions)})
+        sessions = cache.get(('sessions', socket or mgrs['config'].tmux_socket),
+                             lambda: mgrs['tmux'].get_sessions(socket=socket))
+        return etag_json({'sessions': sessions, 'count': len(sessions)})
     
     @app.route('/api/sessions', methods=['POST'])
     def create_session():
-        mgrs = get_managers()
-        data = request.get_json() or {}
-        name = data.get('name', f"session-{uuid.uuid4().hex[:8]}")
-        socket = data.get('socket')
-        success, result = mgrs['tmux'].create_session(name, data.get('cwd'), data.get('command'), socket=socket)
+        body = read_body(schemas.CREATE_SESSION)
+        name = body.name if body.name is not None else f"session-{token_hex(4)}"
+        success, result = mgrs['tmux'].create_session(name, body.cwd, body.command, socket=body.socket)
+        cache.invalidate('sessions')
         if success:
             return jsonify({'status': 'ok', 'session': result})
         return jsonify({'status': 'error', 'message': result}), 400
     
     @app.route('/api/sessions/<name>', methods=['DELETE'])
     def delete_session(name):
-        mgrs = get_managers()
         socket = request.args.get('socket')
         mgrs['pty'].cleanup(name)
-        if mgrs['tmux'].destroy_session(name, socket=socket):
-            return jsonify({'status': 'ok'})
-        return jsonify({'status': 'error', 'message': 'Failed to destroy session'}), 400
+        destroyed = mgrs['tmux'].destroy_session(name, socket=socket)
+        cache.invalidate('sessions')
+        if destroyed:
+            return OK()
+        return DESTROY_FAILED()
     
     @app.route('/api/sessions/<name>/command', methods=['POST'])
     def run_command(name):
-        mgrs = get_managers()
-        data = request.get_json() or {}
-        command = data.get('command', '')
-        socket = data.get('socket')
-        if not command:
-            return jsonify({'status': 'error', 'message': 'No command provided'}), 400
+        body = read_body(schemas.RUN_COMMAND)
+        if not body.command:
+            return NO_COMMAND()
         full_name = mgrs['tmux'].get_full_name(name)
-        if not mgrs['tmux'].session_exists(full_name, socket=socket):
-            return jsonify({'status': 'error', 'message': 'Session not found'}), 404
-        if mgrs['pty'].send_keys(full_name, command + '\n'):
-            return jsonify({'status': 'ok'})
-        return jsonify({'status': 'error', 'message': 'Failed to send command'}), 400
+        success, error = mgrs['pty'].send_keys_if_exists(full_name, body.command + '\n', socket=body.socket)
+        if success:
+            return OK()
+        if error == 'not_found':
+            return SESSION_NOT_FOUND()
+        return SEND_FAILED()
+    
+    @app.route('/api/sessions/<name>/filter', methods=['GET'])
+    def get_session_filter(name):
+        full_name = mgrs['tmux'].get_full_name(name)
+        return jsonify({'status': 'ok', 'session': full_name, 'enabled': mgrs['pty'].is_filtered(full_name)})
+    
+    @app.route('/api/sessions/<name>/filter', methods=['POST'])
+    def set_session_filter(name):
+        enabled = read_body(schemas.SESSION_FILTER).enabled
+        full_name = mgrs['tmux'].get_full_name(name)
+        mgrs['pty'].set_filter(full_name, enabled)
+        return jsonify({'status': 'ok', 'session': full_name, 'enabled': enabled})
     
     @app.route('/api/commands', methods=['GET'])
     def get_all_commands():
-        mgrs = get_managers()
-        return jsonify(mgrs['commands'].get_all())
+        return etag_response(mgrs['commands'].get_all_json())
     
     @app.route('/api/commands/<session>', methods=['GET'])
     def get_session_commands(session):
-        mgrs = get_managers()
-        return jsonify(mgrs['commands'].get(session))
+        return etag_json(mgrs['commands'].get(session))
     
     @app.route('/api/commands/<session>', methods=['POST'])
     def add_command(session):
-        mgrs = get_managers()
-        data = request.get_json() or {}
-        if not data.get('command'):
-            return jsonify({'status': 'error', 'message': 'No command provided'}), 400
-        commands = mgrs['commands'].add(session, data.get('label', 'Command'), data['command'])
+        body = read_body(schemas.ADD_COMMAND)
+        if not body.command:
+            return NO_COMMAND()
+        commands = mgrs['commands'].add(session, body.label, body.command)
         return jsonify({'status': 'ok', 'commands': commands})
     
     @app.route('/api/commands/<session>/<int:index>', methods=['DELETE'])
     def delete_command(session, index):
-        mgrs = get_managers()
         commands = mgrs['commands'].delete(session, index)
         if commands is None:
-            return jsonify({'status': 'error', 'message': 'Command not found'}), 404
+            return COMMAND_NOT_FOUND()
         return jsonify({'status': 'ok', 'commands': commands})
     
     @app.route('/api/x11/check', methods=['GET'])
     def check_x11_deps():
-        mgrs = get_managers()
         missing = mgrs['x11'].check_dependencies()
         if missing:
             return jsonify({
@@ -116,27 +266,25 @@ def register_routes(app):
                 'missing': missing,
                 'install_cmd': 'sudo apt install xvfb x11vnc websockify'
             })
-        return jsonify({'status': 'ok'})
+        return OK()
     
     @app.route('/api/x11/config', methods=['GET'])
     def get_x11_config():
-        mgrs = get_managers()
-        return jsonify({'status': 'ok', 'config': mgrs['x11'].get_fixed_config()})
+        return etag_response(X11_CONFIG)
     
     @app.route('/api/x11/displays', methods=['GET'])
     def list_displays():
-        mgrs = get_managers()
-        return jsonify({'displays': mgrs['x11'].list_displays()})
+        return etag_json({'displays': cache.get('displays', mgrs['x11'].list_displays)})
     
     @app.route('/api/x11/displays', methods=['POST'])
     def create_display():
-        mgrs = get_managers()
-        data = request.get_json() or {}
-        panel_index = data.get('panel_index')
-        display_num = data.get('display_num')
-        width = data.get('width', 1280)
-        height = data.get('height', 800)
-        result, error = mgrs['x11'].start_display(display_num=display_num, panel_index=panel_index, width=width, height=height)
+        body = read_body(schemas.CREATE_DISPLAY)
+        if request.args.get('stream') == '1':
+            return stream_display_start(mgrs['x11'].iter_start_display(
+                display_num=body.display_num, panel_index=body.panel_index, width=body.width, height=body.height))
+        result, error = mgrs['x11'].start_display(display_num=body.display_num, panel_index=body.panel_index,
+                                                  width=body.width, height=body.height)
+        cache.invalidate('displays')
         if error:
             return jsonify({'status': 'error', 'message': error}), 400
         return jsonify({'status': 'ok', 'display': result})
@@ -151,14 +299,13 @@ def register_routes(app):
         Panel 1 -> :101
         Panel 2 -> :102
         """
-        mgrs = get_managers()
-        data = request.get_json() or {}
+        body = read_body(schemas.DISPLAY_SIZE)
         
-        if panel_index not in [0, 1, 2]:
-            return jsonify({'status': 'error', 'message': 'Invalid panel index. Must be 0, 1, or 2'}), 400
+        if panel_index not in VALID_PANELS:
+            return INVALID_PANEL()
         
-        width = data.get('width', 1280)
-        height = data.get('height', 800)
+        width = body.width
+        height = body.height
         display_num = mgrs['x11'].get_display_for_panel(panel_index)
         
         existing = mgrs['x11'].get_display(display_num)
@@ -170,7 +317,13 @@ def register_routes(app):
                 'message': f'Display :{display_num} already running'
             })
         
+        if request.args.get('stream') == '1':
+            return stream_display_start(
+                mgrs['x11'].iter_start_display(panel_index=panel_index, width=width, height=height),
+                created=True, message=f'Display :{display_num} created')
+        
         result, error = mgrs['x11'].start_display_for_panel(panel_index, width=width, height=height)
+        cache.invalidate('displays')
         if error:
             return jsonify({'status': 'error', 'message': error}), 400
         
@@ -183,80 +336,70 @@ def register_routes(app):
     
     @app.route('/api/x11/panel/<int:panel_index>/disconnect', methods=['POST'])
     def disconnect_panel(panel_index):
-        mgrs = get_managers()
-        if panel_index not in [0, 1, 2]:
-            return jsonify({'status': 'error', 'message': 'Invalid panel index'}), 400
+        if panel_index not in VALID_PANELS:
+            return INVALID_PANEL()
         display_num = mgrs['x11'].get_display_for_panel(panel_index)
         success, error = mgrs['x11'].stop_display(display_num)
+        cache.invalidate('displays')
         if not success:
             return jsonify({'status': 'error', 'message': error}), 404
         return jsonify({'status': 'ok', 'message': f'Display :{display_num} stopped'})
     
     @app.route('/api/x11/displays/<int:display_num>', methods=['GET'])
     def get_display(display_num):
-        mgrs = get_managers()
         info = mgrs['x11'].get_display(display_num)
         if info:
-            return jsonify({'status': 'ok', 'display': info})
-        return jsonify({'status': 'none', 'message': 'Display not found'})
+            return etag_json({'status': 'ok', 'display': info})
+        return NO_DISPLAY()
     
     @app.route('/api/x11/displays/<int:display_num>', methods=['DELETE'])
     def delete_display(display_num):
-        mgrs = get_managers()
         success, error = mgrs['x11'].stop_display(display_num)
+        cache.invalidate('displays')
         if not success:
             return jsonify({'status': 'error', 'message': error}), 404
-        return jsonify({'status': 'ok'})
+        return OK()
     
     @app.route('/api/x11/displays/<int:display_num>/resize', methods=['POST'])
     def resize_display(display_num):
-        mgrs = get_managers()
-        data = request.get_json() or {}
-        width = data.get('width', 1280)
-        height = data.get('height', 800)
-        result, error = mgrs['x11'].resize_display(display_num, width, height)
+        body = read_body(schemas.DISPLAY_SIZE)
+        result, error = mgrs['x11'].resize_display(display_num, body.width, body.height)
+        cache.invalidate('displays')
         if error:
             return jsonify({'status': 'error', 'message': error}), 400
         return jsonify({'status': 'ok', 'display': result})
     
     @app.route('/api/x11/displays/<int:display_num>/env', methods=['GET'])
     def get_display_env(display_num):
-        mgrs = get_managers()
-        env_cmd = mgrs['x11'].get_env_setup_commands(display_num)
+        env_cmd = mgrs['x11'].display_exists(display_num) and mgrs['x11'].get_env_setup_commands(display_num)
         if env_cmd:
-            return jsonify({'status': 'ok', 'command': env_cmd, 'display': f':{display_num}'})
-        return jsonify({'status': 'error', 'message': 'Display not found'}), 404
+            return etag_json({'status': 'ok', 'command': env_cmd, 'display': f':{display_num}'})
+        return DISPLAY_NOT_FOUND()
     
     @app.route('/api/sessions/<session>/bind-display', methods=['POST'])
     def bind_display_to_session(session):
-        mgrs = get_managers()
-        data = request.get_json() or {}
-        display_num = data.get('display_num')
-        panel_index = data.get('panel_index')
-        socket = data.get('socket')
+        body = read_body(schemas.BIND_DISPLAY)
+        display_num = body.display_num
+        panel_index = body.panel_index
+        socket = body.socket
         
         if display_num is None and panel_index is not None:
             display_num = mgrs['x11'].get_display_for_panel(panel_index)
         
         if display_num is None:
-            return jsonify({'status': 'error', 'message': 'display_num or panel_index required'}), 400
+            return DISPLAY_REQUIRED()
         
         display_info = mgrs['x11'].get_display(display_num)
         if not display_info:
             return jsonify({'status': 'error', 'message': f'Display :{display_num} not found'}), 404
         
         full_name = mgrs['tmux'].get_full_name(session)
-        if not mgrs['tmux'].session_exists(full_name, socket=socket):
-            return jsonify({'status': 'error', 'message': 'Session not found'}), 404
-        
         display = f":{display_num}"
-        mgrs['tmux'].set_environment(full_name, "DISPLAY", display, socket=socket)
-        mgrs['tmux'].set_environment(full_name, "WAYLAND_DISPLAY", unset=True, socket=socket)
-        mgrs['tmux'].set_environment(full_name, "GDK_BACKEND", "x11", socket=socket)
-        mgrs['tmux'].set_environment(full_name, "QT_QPA_PLATFORM", "xcb", socket=socket)
-        mgrs['tmux'].set_environment(full_name, "LIBGL_ALWAYS_SOFTWARE", "1", socket=socket)
-        mgrs['tmux'].set_environment(full_name, "GALLIUM_DRIVER", "llvmpipe", socket=socket)
-        mgrs['tmux'].set_environment(full_name, "MESA_GL_VERSION_OVERRIDE", "3.3", socket=socket)
+        # Only look the session up if setting its environment failed
+        if not mgrs['tmux'].set_environment_bulk(full_name, {"DISPLAY": display, **GUI_ENV},
+                                                 unset=GUI_ENV_UNSET, socket=socket):
+            if not mgrs['tmux'].session_exists(full_name, socket=socket):
+                return SESSION_NOT_FOUND()
         
         env_cmd = mgrs['x11'].get_env_setup_commands(display_num)
         if env_cmd:
@@ -271,8 +414,7 @@ def register_routes(app):
     
     @app.route('/api/sessions/<session>/unbind-display', methods=['POST'])
     def unbind_display_from_session(session):
-        mgrs = get_managers()
-        socket = request.get_json().get('socket') if request.get_json() else None
+        socket = read_body(schemas.SESSION_SOCKET).socket
         full_name = mgrs['tmux'].get_full_name(session)
         mgrs['tmux'].set_environment(full_name, "DISPLAY", unset=True, socket=socket)
         mgrs['pty'].send_keys(full_name, 'unset DISPLAY\n')
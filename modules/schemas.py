@@ -0,0 +1,106 @@
+"""
+Request body schemas for the REST API.
+
+Bodies are decoded and validated in a single pass with msgspec when it is
+installed. Without it the same defaults and type checks are applied in Python.
+"""
+
+from typing import Optional
+from collections import namedtuple
+
+from . import jsonio
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class BodyError(ValueError):
+    """Raised when a request body does not match its schema."""
+
+
+class Schema:
+    """A JSON object schema built from (field, type, default) triples.
+    
+    A default of None makes the field optional (null is accepted). Unknown
+    fields are ignored.
+    """
+    
+    def __init__(self, name, *fields):
+        self.name = name
+        self.fields = fields
+        if msgspec is not None:
+            struct = msgspec.defstruct(name, [
+                (field, Optional[kind] if default is None else kind, default)
+                for field, kind, default in fields
+            ])
+            self._decoder = msgspec.json.Decoder(struct)
+        else:
+            self._decoder = None
+            self._type = namedtuple(name, [field for field, _, _ in fields])
+        # All-defaults body, shared by requests that send no body (do not mutate)
+        self.empty = self.decode(b'{}')
+    
+    def decode(self, raw):
+        """Decode raw request bytes (empty means {}) into an attribute object."""
+        raw = raw or b'{}'
+        if self._decoder is not None:
+            try:
+                return self._decoder.decode(raw)
+            except msgspec.DecodeError as e:
+                raise BodyError(str(e)) from None
+        
+        try:
+            data = jsonio.loads(raw)
+        except ValueError as e:
+            raise BodyError(f"Invalid JSON: {e}") from None
+        if not isinstance(data, dict):
+            raise BodyError(f"Expected `object`, got `{type(data).__name__}`")
+        values = []
+        for field, kind, default in self.fields:
+            value = data.get(field, default)
+            if value is None and default is None:
+                values.append(None)
+                continue
+            # bool is an int subclass, but JSON true is not a valid width
+            if not isinstance(value, kind) or (isinstance(value, bool) and kind is not bool):
+                raise BodyError(f"Expected `{kind.__name__}`, got `{type(value).__name__}` - at `$.{field}`")
+            values.append(value)
+        return self._type(*values)
+
+
+CREATE_SESSION = Schema('CreateSession',
+                        ('name', str, None),
+                        ('cwd', str, None),
+                        ('command', str, None),
+                        ('socket', str, None))
+
+RUN_COMMAND = Schema('RunCommand',
+                     ('command', str, ''),
+                     ('socket', str, None))
+
+SESSION_FILTER = Schema('SessionFilter',
+                        ('enabled', bool, True))
+
+ADD_COMMAND = Schema('AddCommand',
+                     ('label', str, 'Command'),
+                     ('command', str, ''))
+
+CREATE_DISPLAY = Schema('CreateDisplay',
+                        ('display_num', int, None),
+                        ('panel_index', int, None),
+                        ('width', int, 1280),
+                        ('height', int, 800))
+
+DISPLAY_SIZE = Schema('DisplaySize',
+                      ('width', int, 1280),
+                      ('height', int, 800))
+
+SESSION_SOCKET = Schema('SessionSocket',
+                        ('socket', str, None))
+
+BIND_DISPLAY = Schema('BindDisplay',
+                      ('display_num', int, None),
+                      ('panel_index', int, None),
+                      ('socket', str, None))
@@ -3,75 +3,376 @@ Tmux session management.
 """
 
 import os
+import re
 import subprocess
 import signal
 import time
+import select
+import threading
+
+# Escapes for arguments sent over a control-mode connection (tmux double-quote syntax)
+CONTROL_ESCAPES = {c: f"\\{c:03o}" for c in [*range(0x20), 0x7f]}
+CONTROL_ESCAPES.update({
+    ord('\\'): '\\\\', ord('"'): '\\"', ord('$'): '\\$',
+    ord('\n'): '\\n', ord('\t'): '\\t', ord('\r'): '\\r',
+})
+
+
+def _decode_lines(lines):
+    """Join raw output lines (newline-terminated) and decode them in one call."""
+    if not lines:
+        return ''
+    lines.append(b'')
+    return b'\n'.join(lines).decode('utf-8', errors='replace')
+
+
+class TmuxControlClient:
+    """Persistent tmux control-mode (-C) client for running commands without fork+exec."""
+    
+    TIMEOUT = 5.0      # Seconds to wait for a command's response
+    RETRY_DELAY = 1.0  # Seconds before retrying a failed attach
+    
+    # Oldest tmux with -N and refresh-client -f no-output
+    MIN_VERSION = (3, 2)
+    
+    # Hidden session the control client lives in. Attaching to a user session
+    # would end the client (%exit) whenever that session is killed.
+    SESSION = "ccpan-control"
+    
+    def __init__(self, socket):
+        self.socket = socket
+        self._proc = None
+        self._buf = b''
+        self._lock = threading.Lock()
+        self._retry_at = 0
+        self._supported = None  # None until checked; False once tmux is too old
+    
+    def _check_version(self):
+        """Whether the installed tmux can host the client (checked once)."""
+        if self._supported is None:
+            try:
+                version = subprocess.run(["tmux", "-V"], capture_output=True, text=True).stdout
+            except OSError:
+                version = ''
+            # Development builds ("tmux master") carry no number; assume they are new
+            match = re.search(r'(\d+)\.(\d+)', version)
+            self._supported = bool(version) and (
+                match is None or (int(match[1]), int(match[2])) >= self.MIN_VERSION)
+        return self._supported
+    
+    def _start(self):
+        """Attach a control-mode client to its own session.
+        
+        -N keeps this from starting a tmux server: with none running there are
+        no sessions to manage, and callers fall back to one-off processes.
+        """
+        self._proc = subprocess.Popen(["tmux", "-L", self.socket, "-N", "-C",
+                                       "new-session", "-A", "-s", self.SESSION],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL)
+        self._buf = b''
+        # Commands sent before the attach completes run with no current client, so
+        # wait for the attach's own response block first (flags 0)
+        deadline = time.monotonic() + self.TIMEOUT
+        while True:
+            try:
+                line = self._readline(deadline)
+            except subprocess.TimeoutExpired:
+                line = None
+            if line is None or line.startswith(b'%exit'):
+                self.close()
+                return False
+            if line.startswith((b'%end ', b'%error ')):
+                break
+        # Don't stream %output notifications for every pane (tmux >= 3.2). Without
+        # this nobody drains the pane output, so older servers use subprocesses.
+        result = self._command([("refresh-client", "-f", "no-output")])
+        if result is not None and result.returncode != 0:
+            self._supported = False  # The server predates the flag; don't retry
+        if result is None or result.returncode != 0 or self._proc is None:
+            self.close()
+            return False
+        return True
+    
+    def close(self):
+        """Shut down the control-mode client."""
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+            try:
+                proc.kill()
+                proc.wait(timeout=1)
+            except Exception:
+                pass
+    
+    def _readline(self, deadline):
+        """Read one line from the control client, or None on EOF.
+        
+        Raises subprocess.TimeoutExpired if no full line arrives by the deadline.
+        """
+        fd = self._proc.stdout.fileno()
+        while b'\n' not in self._buf:
+            remaining = deadline - time.monotonic()
+            readable = remaining > 0 and select.select([fd], [], [], remaining)[0]
+            if not readable:
+                raise subprocess.TimeoutExpired(self._proc.args, self.TIMEOUT)
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return None
+            self._buf += chunk
+        line, _, self._buf = self._buf.partition(b'\n')
+        return line
+    
+    def _alive(self):
+        """Discard queued notifications; False if the client has exited.
+        
+        tmux prints %exit when it detaches the client, possibly well before the
+        process itself goes away, so poll() alone can't tell.
+        """
+        if self._proc.poll() is not None:
+            return False
+        fd = self._proc.stdout.fileno()
+        while select.select([fd], [], [], 0)[0]:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return False
+            self._buf += chunk
+        lines, _, self._buf = self._buf.rpartition(b'\n')
+        return b'\n%exit' not in b'\n' + lines
+    
+    def _command(self, commands):
+        """Send commands (one line each) and wait for their %begin/%end blocks.
+        
+        All lines are written at once and the responses are read back in order.
+        Returns a CompletedProcess, or None if the connection failed before
+        tmux started answering (the commands were not run, so it is safe to
+        retry another way). Raises subprocess.TimeoutExpired if tmux stops
+        answering: the commands may or may not have run.
+        """
+        lines = ''.join(
+            ' '.join(f'"{arg.translate(CONTROL_ESCAPES)}"' for arg in args) + '\n'
+            for args in commands
+        )
+        try:
+            self._proc.stdin.write(lines.encode('utf-8'))
+            self._proc.stdin.flush()
+        except (OSError, ValueError):
+            self.close()
+            return None
+        
+        deadline = time.monotonic() + self.TIMEOUT
+        returncode = 0
+        stdout = []
+        stderr = []
+        remaining = len(commands)
+        block = None
+        output = []
+        while remaining:
+            try:
+                raw = self._readline(deadline)
+            except subprocess.TimeoutExpired:
+                # Leave no half-read response behind for the next command
+                self.close()
+                raise subprocess.TimeoutExpired(commands, self.TIMEOUT,
+                                                _decode_lines(stdout)) from None
+            if raw is None or (block is None and raw.startswith(b'%exit')):
+                # The client is gone (e.g. its session was destroyed)
+                self.close()
+                if remaining == len(commands) and block is None:
+                    return None
+                return subprocess.CompletedProcess(commands, 1, _decode_lines(stdout),
+                                                   'tmux control connection lost')
+            # Lines are matched as bytes; only command output is decoded, once
+            if block is None:
+                # Skip notifications and blocks for commands we didn't send (flags != 1)
+                if raw.startswith(b'%begin ') and raw.endswith(b' 1'):
+                    block = raw[len(b'%begin '):]
+                    end, error = b'%end ' + block, b'%error ' + block
+                continue
+            if raw == end:
+                stdout.extend(output)
+            elif raw == error:
+                returncode = 1
+                stderr.extend(output)
+            else:
+                output.append(raw)
+                continue
+            block = None
+            output = []
+            remaining -= 1
+        return subprocess.CompletedProcess(commands, returncode,
+                                           _decode_lines(stdout), _decode_lines(stderr))
+    
+    def run(self, commands):
+        """Run a list of tmux commands; returns None if control mode is unavailable.
+        
+        Also returns None while another caller is using the client, so one slow
+        command (e.g. a large capture-pane) never holds up everyone else.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._proc is None or not self._alive():
+                self.close()
+                if time.monotonic() < self._retry_at or not self._check_version():
+                    return None
+                try:
+                    started = self._start()
+                except OSError:
+                    started = False
+                if not started:
+                    self._retry_at = time.monotonic() + self.RETRY_DELAY
+                    return None
+            return self._command(commands)
+        finally:
+            self._lock.release()
 
 
 class TmuxManager:
     """Manages tmux sessions."""
     
+    # Max raw -> prefixed session names remembered before the cache is reset
+    FULL_NAME_CACHE_SIZE = 1024
+    
+    # Max seconds to wait for a new session's prompt before sending its command
+    PROMPT_TIMEOUT = 0.2
+    PROMPT_POLL_INTERVAL = 0.005
+    
     def __init__(self, config):
         self.config = config
+        self._control_clients = {}  # socket -> TmuxControlClient
+        self._full_names = {}  # raw session name -> prefixed name
+        self._full_names_prefix = None  # session prefix _full_names was built for
+        self._server_filter = True  # False once tmux rejects list-sessions -f
     
     def _run(self, *args, socket=None):
         """Run a tmux command with the configured socket."""
+        return self._run_many([args], socket=socket)
+    
+    def _run_many(self, commands, socket=None):
+        """Run several tmux commands in one round-trip.
+        
+        Commands go through a persistent control-mode client when one can be
+        attached, falling back to a single tmux process (commands chained with
+        ';') otherwise. If the control client stops answering, the result is a
+        failure; the commands are not retried, as they may already have run.
+        """
         socket = socket or self.config.tmux_socket
-        cmd = ["tmux", "-L", socket] + list(args)
+        client = self._control_clients.get(socket)
+        if client is None:
+            client = self._control_clients[socket] = TmuxControlClient(socket)
+        try:
+            result = client.run(commands)
+        except subprocess.TimeoutExpired as e:
+            # The client has already been closed; the next command starts a new one
+            return subprocess.CompletedProcess(commands, 1, e.output or '',
+                                               f'tmux did not answer within {e.timeout:g}s')
+        if result is not None:
+            return result
+        cmd = ["tmux", "-L", socket]
+        for i, args in enumerate(commands):
+            if i:
+                cmd.append(";")
+            cmd.extend(args)
         result = subprocess.run(cmd, capture_output=True, text=True)
         return result
     
+    def close(self):
+        """Close all control-mode clients."""
+        for client in self._control_clients.values():
+            client.close()
+    
     def get_sessions(self, socket=None):
         """List all sessions with our prefix."""
+        prefix = self.config.session_prefix
+        if self._server_filter and prefix and not any(c in prefix for c in '#,}'):
+            # Let tmux drop other sessions: the first len(prefix) chars must match
+            result = self._run("list-sessions", "-F", "#{session_name}",
+                               "-f", f"#{{==:#{{={len(prefix)}:session_name}},{prefix}}}",
+                               socket=socket)
+            if result.returncode == 0:
+                return [line for line in result.stdout.splitlines()
+                        if line and line != TmuxControlClient.SESSION]
+            if "usage:" not in result.stderr:
+                return []
+            # list-sessions -f needs tmux >= 3.1
+            self._server_filter = False
         result = self._run("list-sessions", "-F", "#{session_name}", socket=socket)
         if result.returncode != 0:
             return []
-        prefix = self.config.session_prefix
-        return [line for line in result.stdout.strip().split('\n') 
-                if line and line.startswith(prefix)]
+        return [line for line in result.stdout.splitlines()
+                if line and line.startswith(prefix) and line != TmuxControlClient.SESSION]
     
     def session_exists(self, name, socket=None):
         """Check if a tmux session exists."""
-        prefix = self.config.session_prefix
-        full_name = name if name.startswith(prefix) else f"{prefix}{name}"
-        return full_name in self.get_sessions(socket=socket)
+        return self.get_full_name(name) in self.get_sessions(socket=socket)
     
     def get_full_name(self, name):
-        """Get the full session name with prefix."""
+        """Get the full session name with prefix (memoized per session prefix)."""
         prefix = self.config.session_prefix
-        return name if name.startswith(prefix) else f"{prefix}{name}"
+        if prefix != self._full_names_prefix:
+            # The prefix can change at runtime through the config API
+            self._full_names = {}
+            self._full_names_prefix = prefix
+        full_name = self._full_names.get(name)
+        if full_name is None:
+            full_name = name if name.startswith(prefix) else f"{prefix}{name}"
+            if len(self._full_names) >= self.FULL_NAME_CACHE_SIZE:
+                self._full_names = {}
+            self._full_names[name] = full_name
+        return full_name
     
     def create_session(self, name, cwd=None, initial_cmd=None, socket=None):
         """Create a new tmux session."""
         prefix = self.config.session_prefix
         full_name = f"{prefix}{name}"
         
-        if self.session_exists(full_name, socket=socket):
-            return False, "Session already exists"
-        
         # Create with small size - will be resized when client connects
         cmd_args = ["new-session", "-d", "-s", full_name, "-x", "80", "-y", "24"]
         if cwd and os.path.isdir(cwd):
             cmd_args.extend(["-c", cwd])
         
+        # No list-sessions precheck: new-session itself rejects duplicates
         result = self._run(*cmd_args, socket=socket)
         if result.returncode != 0:
+            if "duplicate session" in result.stderr:
+                return False, "Session already exists"
             return False, result.stderr
         
-        # Configure session
-        self._run("set-option", "-t", full_name, "mouse", "off", socket=socket)
-        self._run("set-option", "-t", full_name, "history-limit", 
-                  str(self.config.scrollback_limit), socket=socket)
-        self._run("set-window-option", "-t", full_name, "aggressive-resize", "on", socket=socket)
-        self._run("set-option", "-t", full_name, "default-terminal", "xterm-256color", socket=socket)
+        # Configure session (one round-trip for all options)
+        self._run_many([
+            ("set-option", "-t", full_name, "mouse", "off"),
+            ("set-option", "-t", full_name, "history-limit", str(self.config.scrollback_limit)),
+            ("set-window-option", "-t", full_name, "aggressive-resize", "on"),
+            ("set-option", "-t", full_name, "default-terminal", "xterm-256color"),
+        ], socket=socket)
         
         # Run initial command if provided
         if initial_cmd:
-            time.sleep(0.2)
+            self._wait_for_prompt(full_name, socket=socket)
             self._run("send-keys", "-t", full_name, initial_cmd, "Enter", socket=socket)
         
         return True, full_name
     
+    def _wait_for_prompt(self, full_name, socket=None):
+        """Wait (bounded) until the session's shell has drawn something.
+        
+        The cursor leaves the origin once the prompt is printed, which usually
+        takes a few ms; keys sent earlier would be echoed ahead of the prompt.
+        """
+        deadline = time.monotonic() + self.PROMPT_TIMEOUT
+        while True:
+            result = self._run("display-message", "-t", full_name, "-p",
+                               "#{cursor_x},#{cursor_y}", socket=socket)
+            if result.returncode != 0 or result.stdout.strip() != "0,0":
+                return
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(self.PROMPT_POLL_INTERVAL)
+    
     def destroy_session(self, name, socket=None):
         """Destroy a tmux session."""
         full_name = self.get_full_name(name)
@@ -90,6 +391,21 @@ class TmuxManager:
         result = self._run("send-keys", "-t", full_name, "-l", keys, socket=socket)
         return result.returncode == 0
     
+    def send_keys_if_exists(self, name, keys, socket=None):
+        """Send keys to a session, reporting a missing session.
+        
+        The common case is a single tmux round-trip; the session is only looked
+        up when the send fails. Returns (ok, error) where error is 'not_found'
+        or tmux's error message.
+        """
+        full_name = self.get_full_name(name)
+        result = self._run("send-keys", "-t", full_name, "-l", keys, socket=socket)
+        if result.returncode == 0:
+            return True, None
+        if not self.session_exists(full_name, socket=socket):
+            return False, 'not_found'
+        return False, result.stderr.strip() or 'Failed to send keys'
+    
     def send_signal(self, name, sig, socket=None):
         """Send a signal to the foreground process in a session."""
         full_name = self.get_full_name(name)
@@ -100,12 +416,11 @@ class TmuxManager:
         
         try:
             pane_pid = int(result.stdout.strip())
-            children = subprocess.run(["pgrep", "-P", str(pane_pid)], 
-                                      capture_output=True, text=True)
-            if children.stdout.strip():
-                for child_pid in children.stdout.strip().split('\n'):
+            children = self._child_pids(pane_pid)
+            if children:
+                for child_pid in children:
                     try:
-                        os.kill(int(child_pid), sig)
+                        os.kill(child_pid, sig)
                     except:
                         pass
             else:
@@ -114,6 +429,20 @@ class TmuxManager:
         except:
             return False
     
+    def _child_pids(self, pid):
+        """List the direct children of pid, from /proc when possible."""
+        try:
+            children = []
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    children.extend(int(child) for child in f.read().split())
+            return children
+        except FileNotFoundError:
+            # No /proc/<pid>/task/*/children (non-Linux or CONFIG_PROC_CHILDREN off)
+            pass
+        result = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True)
+        return [int(child) for child in result.stdout.split()]
+    
     def set_environment(self, name, var, value=None, unset=False, socket=None):
         """Set or unset an environment variable in a session."""
         full_name = self.get_full_name(name)
@@ -122,6 +451,19 @@ class TmuxManager:
         else:
             self._run("set-environment", "-t", full_name, var, value, socket=socket)
     
+    def set_environment_bulk(self, name, values=None, unset=(), socket=None):
+        """Set and unset several environment variables in a session in one round-trip.
+        
+        Returns False if any of the commands failed (e.g. the session is gone).
+        """
+        full_name = self.get_full_name(name)
+        commands = [("set-environment", "-t", full_name, var, value)
+                    for var, value in (values or {}).items()]
+        commands += [("set-environment", "-t", full_name, "-u", var) for var in unset]
+        if not commands:
+            return True
+        return self._run_many(commands, socket=socket).returncode == 0
+    
     def enter_copy_mode(self, name, socket=None):
         """Enter copy-mode for scrolling."""
         full_name = self.get_full_name(name)
@@ -3,9 +3,23 @@ WebSocket event handlers for the Tmux Control Panel.
 """
 
 import signal
+from types import MappingProxyType
 from flask import request
 from flask_socketio import emit, join_room, leave_room
 
+# Copy-mode scroll commands accepted by the 'scroll' event
+SCROLL_DIRECTIONS = frozenset({'up', 'down', 'page_up', 'page_down', 'top', 'bottom'})
+
+# Signals accepted by the 'signal' event (anything else sends SIGINT)
+SIGNALS = MappingProxyType({
+    'SIGINT': signal.SIGINT,
+    'SIGTERM': signal.SIGTERM,
+    'SIGKILL': signal.SIGKILL,
+    'SIGSTOP': signal.SIGSTOP,
+    'SIGCONT': signal.SIGCONT,
+    'SIGTSTP': signal.SIGTSTP,
+})
+
 
 def register_websocket_handlers(socketio, app):
     """Register all WebSocket event handlers."""
@@ -19,9 +33,7 @@ def register_websocket_handlers(socketio, app):
     
     @socketio.on('disconnect')
     def handle_disconnect():
-        mgrs = get_managers()
-        for session_name in list(mgrs['pty'].connections.keys()):
-            mgrs['pty'].remove_client(session_name, request.sid)
+        get_managers()['pty'].disconnect(request.sid)
     
     @socketio.on('subscribe')
     def handle_subscribe(data):
@@ -38,22 +50,23 @@ def register_websocket_handlers(socketio, app):
         
         full_name = mgrs['tmux'].get_full_name(session_name)
         
-        if not mgrs['tmux'].session_exists(full_name, socket=socket):
-            emit('error', {'message': f'Session {full_name} does not exist'})
-            return
-        
-        # Resize before connecting
-        mgrs['pty'].resize(full_name, cols, rows, socket=socket)
+        # Clients that acknowledge each output frame get backpressure instead
+        # of an unbounded send queue
+        if data.get('flow_control'):
+            mgrs['pty'].enable_flow_control(request.sid)
         
+        # get_or_create() checks that the session exists before spawning a PTY
         join_room(full_name)
-        conn = mgrs['pty'].get_or_create(full_name, request.sid, cols, rows, socket=socket)
+        conn, created = mgrs['pty'].get_or_create(full_name, request.sid, cols, rows, socket=socket)
         
         if not conn:
-            emit('error', {'message': f'Failed to connect to session {full_name}'})
+            leave_room(full_name)
+            emit('error', {'message': f'Session {full_name} does not exist'})
             return
         
-        # Resize again after PTY is connected
-        mgrs['pty'].resize(full_name, cols, rows, socket=socket)
+        # A new PTY is spawned at this size; an existing one may need resizing
+        if not created:
+            mgrs['pty'].resize(full_name, cols, rows, socket=socket)
         
         emit('subscribed', {'session': full_name})
     
@@ -93,7 +106,7 @@ def register_websocket_handlers(socketio, app):
         
         if session_name:
             full_name = mgrs['tmux'].get_full_name(session_name)
-            mgrs['pty'].resize(full_name, cols, rows, socket=socket)
+            mgrs['pty'].schedule_resize(full_name, cols, rows, socket=socket)
     
     @socketio.on('signal')
     def handle_signal(data):
@@ -107,15 +120,7 @@ def register_websocket_handlers(socketio, app):
             return
         
         full_name = mgrs['tmux'].get_full_name(session_name)
-        sig_map = {
-            'SIGINT': signal.SIGINT,
-            'SIGTERM': signal.SIGTERM,
-            'SIGKILL': signal.SIGKILL,
-            'SIGSTOP': signal.SIGSTOP,
-            'SIGCONT': signal.SIGCONT,
-            'SIGTSTP': signal.SIGTSTP,
-        }
-        mgrs['tmux'].send_signal(full_name, sig_map.get(sig_name, signal.SIGINT), socket=socket)
+        mgrs['tmux'].send_signal(full_name, SIGNALS.get(sig_name, signal.SIGINT), socket=socket)
     
     @socketio.on('scroll')
     def handle_scroll(data):
@@ -135,7 +140,7 @@ def register_websocket_handlers(socketio, app):
             mgrs['tmux'].enter_copy_mode(full_name, socket=socket)
         elif command == 'exit':
             mgrs['tmux'].scroll(full_name, 'exit', socket=socket)
-        elif command in ['up', 'down', 'page_up', 'page_down', 'top', 'bottom']:
+        elif command in SCROLL_DIRECTIONS:
             mgrs['tmux'].scroll(full_name, command, lines, socket=socket)
     
     @socketio.on('get_scrollback')
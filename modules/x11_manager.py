@@ -11,8 +11,22 @@ import os
 import subprocess
 import signal
 import time
+import select
 import shutil
+import threading
 import socket as sock
+from functools import lru_cache
+
+
+@lru_cache(maxsize=16)
+def _env_setup_commands(display):
+    """Shell snippet pointing a session at display (depends only on display)."""
+    return (
+        f"export DISPLAY={display} && "
+        f"unset WAYLAND_DISPLAY && "
+        f"export GDK_BACKEND=x11 && "
+        f"export QT_QPA_PLATFORM=xcb"
+    )
 
 
 class X11Manager:
@@ -25,6 +39,9 @@ class X11Manager:
         2: 102,  # GUI Panel 3 -> :102
     }
     
+    # Reverse lookup: display -> GUI panel index
+    FIXED_PANELS = {num: panel for panel, num in FIXED_DISPLAYS.items()}
+    
     FIXED_VNC_PORTS = {
         100: 5900,
         101: 5901,
@@ -37,46 +54,97 @@ class X11Manager:
         102: 6102,
     }
     
+    # Max seconds to wait for each launched process to come up, and the poll step
+    READY_TIMEOUT = 2.0
+    READY_POLL_INTERVAL = 0.01
+    
+    # Seconds stopped processes get to exit after SIGTERM before SIGKILL
+    STOP_TIMEOUT = 0.2
+    
     def __init__(self):
         self.displays = {}
+        
+        # X11-only environment for display processes, filtered once; DISPLAY is
+        # overlaid per display
+        self._base_env = {k: v for k, v in os.environ.items()
+                          if k not in ('WAYLAND_DISPLAY', 'XDG_SESSION_TYPE')}
+        self._base_env['GDK_BACKEND'] = 'x11'
+        self._base_env['QT_QPA_PLATFORM'] = 'xcb'
     
     def _get_clean_env(self, display):
-        clean_env = os.environ.copy()
-        clean_env.pop('WAYLAND_DISPLAY', None)
-        clean_env.pop('XDG_SESSION_TYPE', None)
-        clean_env['DISPLAY'] = display
-        clean_env['GDK_BACKEND'] = 'x11'
-        clean_env['QT_QPA_PLATFORM'] = 'xcb'
-        return clean_env
+        return {**self._base_env, 'DISPLAY': display}
     
     def _is_display_available(self, display_num):
         lock_file = f"/tmp/.X{display_num}-lock"
         socket_file = f"/tmp/.X11-unix/X{display_num}"
         return not os.path.exists(lock_file) and not os.path.exists(socket_file)
     
+    def _wait_ready(self, proc, ready):
+        """Wait until ready() is true or proc exits, polling every READY_POLL_INTERVAL.
+        
+        Gives up silently after READY_TIMEOUT; the caller checks proc.poll().
+        """
+        deadline = time.monotonic() + self.READY_TIMEOUT
+        while proc.poll() is None and not ready():
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(self.READY_POLL_INTERVAL)
+    
+    def _discard_output(self, pipe):
+        """Read and drop everything written to pipe until it closes."""
+        def drain():
+            with pipe:
+                while pipe.read(65536):
+                    pass
+        
+        threading.Thread(target=drain, daemon=True).start()
+    
     def _is_port_available(self, port):
+        # Probe for a listener instead of binding the port ourselves, which would
+        # briefly hold it while x11vnc/websockify are about to bind it
+        s = sock.socket(sock.AF_INET, sock.SOCK_STREAM)
         try:
-            s = sock.socket(sock.AF_INET, sock.SOCK_STREAM)
-            s.bind(('127.0.0.1', port))
+            s.settimeout(0.05)
+            return s.connect_ex(('127.0.0.1', port)) != 0
+        finally:
             s.close()
-            return True
-        except OSError:
-            return False
+    
+    def _display_summary(self, display_num):
+        """Public view of a running display, as returned by the API."""
+        info = self.displays[display_num]
+        return {
+            'display': info['display'],
+            'display_num': display_num,
+            'panel_index': info['panel_index'],
+            'ws_port': info['ws_port'],
+            'width': info['width'],
+            'height': info['height']
+        }
     
     def get_display_for_panel(self, panel_index):
         return self.FIXED_DISPLAYS.get(panel_index)
     
     def get_panel_for_display(self, display_num):
-        for panel, num in self.FIXED_DISPLAYS.items():
-            if num == display_num:
-                return panel
-        return None
+        return self.FIXED_PANELS.get(display_num)
     
     def check_dependencies(self):
         required = ['Xvfb', 'x11vnc', 'websockify']
         return [cmd for cmd in required if not shutil.which(cmd)]
     
     def start_display(self, display_num=None, panel_index=None, width=1280, height=800, depth=24):
+        steps = self.iter_start_display(display_num=display_num, panel_index=panel_index,
+                                        width=width, height=height, depth=depth)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as done:
+                return done.value
+    
+    def iter_start_display(self, display_num=None, panel_index=None, width=1280, height=800, depth=24):
+        """Start a display, yielding the name of each process as it is launched.
+        
+        The generator's return value is (display_info, error) like start_display.
+        """
         missing = self.check_dependencies()
         if missing:
             return None, f"Missing dependencies: {', '.join(missing)}. Install with: sudo apt install xvfb x11vnc websockify"
@@ -93,15 +161,7 @@ class X11Manager:
             return None, "Must specify display_num or panel_index"
         
         if actual_display_num in self.displays:
-            info = self.displays[actual_display_num]
-            return {
-                'display': info['display'],
-                'display_num': actual_display_num,
-                'panel_index': self.get_panel_for_display(actual_display_num),
-                'ws_port': info['ws_port'],
-                'width': info['width'],
-                'height': info['height']
-            }, None
+            return self._display_summary(actual_display_num), None
         
         vnc_port = self.FIXED_VNC_PORTS[actual_display_num]
         ws_port = self.FIXED_WS_PORTS[actual_display_num]
@@ -116,42 +176,52 @@ class X11Manager:
         display = f":{actual_display_num}"
         clean_env = self._get_clean_env(display)
         
+        procs = []  # Started so far; stopped again unless the display is recorded
         try:
+            yield 'xvfb'
             xvfb_cmd = [
                 "Xvfb", display,
                 "-screen", "0", f"{width}x{height}x{depth}",
                 "-ac", "+extension", "GLX", "+extension", "RENDER", "-nolisten", "tcp"
             ]
-            xvfb_proc = subprocess.Popen(xvfb_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=clean_env)
-            time.sleep(0.5)
+            xvfb_proc = subprocess.Popen(xvfb_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=clean_env)
+            procs.append(xvfb_proc)
+            x_socket = f"/tmp/.X11-unix/X{actual_display_num}"
+            self._wait_ready(xvfb_proc, lambda: os.path.exists(x_socket))
             
             if xvfb_proc.poll() is not None:
                 _, stderr = xvfb_proc.communicate()
                 return None, f"Failed to start Xvfb: {stderr.decode()}"
             
+            yield 'x11vnc'
             vnc_cmd = [
                 "x11vnc", "-display", display,
                 "-rfbport", str(vnc_port),
                 "-nopw", "-forever", "-shared", "-noxdamage", "-wait", "5", "-defer", "5"
             ]
-            vnc_proc = subprocess.Popen(vnc_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=clean_env)
-            time.sleep(0.5)
+            vnc_proc = subprocess.Popen(vnc_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=clean_env)
+            procs.append(vnc_proc)
+            self._wait_ready(vnc_proc, lambda: not self._is_port_available(vnc_port))
             
             if vnc_proc.poll() is not None:
                 _, stderr = vnc_proc.communicate()
-                xvfb_proc.terminate()
                 return None, f"Failed to start x11vnc: {stderr.decode()}"
             
+            yield 'websockify'
             ws_cmd = ["websockify", str(ws_port), f"127.0.0.1:{vnc_port}"]
-            ws_proc = subprocess.Popen(ws_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            time.sleep(0.3)
+            ws_proc = subprocess.Popen(ws_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            procs.append(ws_proc)
+            self._wait_ready(ws_proc, lambda: not self._is_port_available(ws_port))
             
             if ws_proc.poll() is not None:
                 _, stderr = ws_proc.communicate()
-                vnc_proc.terminate()
-                xvfb_proc.terminate()
                 return None, f"Failed to start websockify: {stderr.decode()}"
             
+            # stderr is only read on a failed start; keep the pipes drained from
+            # now on so a chatty process never blocks on a full pipe
+            for proc in (xvfb_proc, vnc_proc, ws_proc):
+                self._discard_output(proc.stderr)
+            
             self.displays[actual_display_num] = {
                 'display': display,
                 'display_num': actual_display_num,
@@ -166,17 +236,27 @@ class X11Manager:
                 'sessions': set()
             }
             
-            return {
-                'display': display,
-                'display_num': actual_display_num,
-                'panel_index': self.get_panel_for_display(actual_display_num),
-                'ws_port': ws_port,
-                'width': width,
-                'height': height
-            }, None
+            return self._display_summary(actual_display_num), None
             
         except Exception as e:
             return None, str(e)
+        finally:
+            # Also reached via GeneratorExit when a streaming client goes away
+            # mid-start; an unrecorded process would hold the display forever
+            if actual_display_num not in self.displays:
+                self._stop_procs(procs)
+    
+    def _stop_procs(self, procs):
+        """Terminate and reap processes from a start that did not complete."""
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=self.STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
     
     def start_display_for_panel(self, panel_index, width=1280, height=800):
         return self.start_display(panel_index=panel_index, width=width, height=height)
@@ -186,59 +266,90 @@ class X11Manager:
             return False, "Display not found"
         
         info = self.displays[display_num]
-        
-        for pid_key in ['ws_pid', 'vnc_pid', 'xvfb_pid']:
-            pid = info.get(pid_key)
-            if pid:
-                try:
-                    os.kill(pid, signal.SIGTERM)
-                    time.sleep(0.1)
-                    os.kill(pid, signal.SIGKILL)
-                except ProcessLookupError:
-                    pass
-                except Exception:
-                    pass
+        self._terminate([info.get(key) for key in ('ws_pid', 'vnc_pid', 'xvfb_pid') if info.get(key)])
         
         del self.displays[display_num]
         return True, None
     
-    def get_display(self, display_num):
-        if display_num not in self.displays:
-            return None
-        
-        info = self.displays[display_num]
-        
+    def _xvfb_alive(self, info):
+        """Check whether a display's Xvfb process is still running."""
         try:
             os.kill(info['xvfb_pid'], 0)
         except ProcessLookupError:
+            return False
+        except PermissionError:
+            # The pid was recycled by another user's process; our Xvfb is gone
+            return False
+        return True
+    
+    def _terminate(self, pids):
+        """SIGTERM pids, wait for them together, then SIGKILL any still running.
+        
+        Exits are watched through pidfds, so the wait ends as soon as the last
+        process is gone and a recycled pid is never killed. Without pidfd
+        support the processes get the full STOP_TIMEOUT.
+        """
+        pidfds = []
+        unwatched = []
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                continue
+            try:
+                pidfds.append(os.pidfd_open(pid))
+            except (AttributeError, OSError):
+                unwatched.append(pid)
+        
+        deadline = time.monotonic() + self.STOP_TIMEOUT
+        while pidfds:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(pidfds, [], [], remaining)
+            for pidfd in readable:
+                pidfds.remove(pidfd)
+                os.close(pidfd)
+        if unwatched:
+            time.sleep(max(0, deadline - time.monotonic()))
+        
+        for pidfd in pidfds:
+            try:
+                signal.pidfd_send_signal(pidfd, signal.SIGKILL)
+            except OSError:
+                pass
+            os.close(pidfd)
+        for pid in unwatched:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+    
+    def display_exists(self, display_num):
+        """Check one display directly, reaping it if its Xvfb has exited."""
+        info = self.displays.get(display_num)
+        if info is None:
+            return False
+        
+        if not self._xvfb_alive(info):
             self.stop_display(display_num)
-            return None
+            return False
         
-        return {
-            'display': info['display'],
-            'display_num': display_num,
-            'panel_index': self.get_panel_for_display(display_num),
-            'ws_port': info['ws_port'],
-            'width': info['width'],
-            'height': info['height']
-        }
+        return True
+    
+    def get_display(self, display_num):
+        if not self.display_exists(display_num):
+            return None
+        return self._display_summary(display_num)
     
     def list_displays(self):
         result = []
         dead = []
         
         for display_num, info in self.displays.items():
-            try:
-                os.kill(info['xvfb_pid'], 0)
-                result.append({
-                    'display': info['display'],
-                    'display_num': display_num,
-                    'panel_index': self.get_panel_for_display(display_num),
-                    'ws_port': info['ws_port'],
-                    'width': info['width'],
-                    'height': info['height']
-                })
-            except ProcessLookupError:
+            if self._xvfb_alive(info):
+                result.append(self._display_summary(display_num))
+            else:
                 dead.append(display_num)
         
         for d in dead:
@@ -273,13 +384,7 @@ class X11Manager:
     def get_env_setup_commands(self, display_num):
         if display_num not in self.displays:
             return None
-        display = self.displays[display_num]['display']
-        return (
-            f"export DISPLAY={display} && "
-            f"unset WAYLAND_DISPLAY && "
-            f"export GDK_BACKEND=x11 && "
-            f"export QT_QPA_PLATFORM=xcb"
-        )
+        return _env_setup_commands(self.displays[display_num]['display'])
     
     def get_env_dict(self, display_num):
         if display_num not in self.displays:
@@ -15,13 +15,26 @@ import warnings
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, SCRIPT_DIR)
 
-# Try to use eventlet for better WebSocket support (suppress deprecation warning)
-warnings.filterwarnings('ignore', category=DeprecationWarning, module='eventlet')
-try:
-    import eventlet
-    eventlet.monkey_patch()
-    ASYNC_MODE = 'eventlet'
-except ImportError:
+# Prefer gevent, then eventlet, for cooperative I/O (must patch before Flask is imported).
+# Set CCPAN_ASYNC_MODE to force one of gevent/eventlet/threading.
+ASYNC_MODE = os.environ.get('CCPAN_ASYNC_MODE')
+if ASYNC_MODE in (None, 'gevent'):
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+        ASYNC_MODE = 'gevent'
+    except ImportError:
+        ASYNC_MODE = None
+if ASYNC_MODE in (None, 'eventlet'):
+    # Suppress eventlet's deprecation warning
+    warnings.filterwarnings('ignore', category=DeprecationWarning, module='eventlet')
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+        ASYNC_MODE = 'eventlet'
+    except ImportError:
+        ASYNC_MODE = None
+if ASYNC_MODE is None:
     ASYNC_MODE = 'threading'
 
 from flask import Flask
@@ -65,7 +78,7 @@ def create_app():
     }
     
     # Register routes and handlers
-    register_routes(app)
+    register_routes(app, socketio)
     register_websocket_handlers(socketio, app)
     
     # Cleanup on exit
@@ -73,6 +86,9 @@ def create_app():
         print("\nCleaning up...")
         x11_mgr.cleanup_all()
         pty_mgr.cleanup_all()
+        tmux_mgr.close()
+        cmd_mgr.flush()
+        config.flush()
     
     atexit.register(cleanup)
     
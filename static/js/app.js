@@ -106,8 +106,16 @@ function connectWebSocket() {
             }
         }, 100);
     });
-    state.socket.on('output', (data) => {
-        if (state.terminal && data.session === state.currentSession) state.terminal.write(data.data);
+    state.socket.on('output', (data, ack) => {
+        // With flow_control the server holds further output until this frame is
+        // acknowledged, so ack once xterm.js has processed it
+        const done = () => { if (ack) ack(); };
+        if (state.terminal && data.session === state.currentSession) {
+            // Output arrives as a binary attachment (raw UTF-8 bytes); xterm.js decodes it
+            state.terminal.write(typeof data.data === 'string' ? data.data : new Uint8Array(data.data), done);
+        } else {
+            done();
+        }
     });
     state.socket.on('error', (data) => console.error('Server error:', data.message));
 }
@@ -160,10 +168,16 @@ function initTerminal() {
         }
     });
     
+    // Dragging a splitter refits on every mousemove; only send the size the
+    // terminal settles on (the server debounces too, this saves the messages)
+    let resizeTimer;
     state.terminal.onResize(({ cols, rows }) => {
-        if (state.currentSession && state.socket?.connected) {
-            state.socket.emit('resize', { session: state.currentSession, cols, rows });
-        }
+        clearTimeout(resizeTimer);
+        resizeTimer = setTimeout(() => {
+            if (state.currentSession && state.socket?.connected) {
+                state.socket.emit('resize', { session: state.currentSession, cols, rows });
+            }
+        }, 50);
     });
 }
 
@@ -237,7 +251,7 @@ async function selectSession(session) {
     setTimeout(() => {
         state.fitAddon.fit();
         if (state.socket?.connected) {
-            state.socket.emit('subscribe', { session, cols: state.terminal.cols, rows: state.terminal.rows });
+            state.socket.emit('subscribe', { session, cols: state.terminal.cols, rows: state.terminal.rows, flow_control: true });
         }
     }, 150);
 }
@@ -542,6 +556,37 @@ function stopDrag() {
     document.removeEventListener('mouseup', stopDrag);
 }
 
+/**
+ * Read a display start-up response. Streamed responses report each launched
+ * process through onStep and resolve with the final event; plain JSON
+ * responses (e.g. display already running) resolve directly.
+ */
+async function readDisplayStream(response, onStep) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.startsWith('text/event-stream')) {
+        return response.json();
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let last = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const line = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            if (!line.startsWith('data: ')) continue;
+            last = JSON.parse(line.slice(6));
+            if (last.step !== 'done' && last.step !== 'error') onStep(last.step);
+        }
+    }
+    return last || { status: 'error', message: 'Display start-up stream ended unexpectedly' };
+}
+
 /**
  * Connect GUI panel - creates display on demand
  * Panel 0 -> :100, Panel 1 -> :101, Panel 2 -> :102
@@ -557,12 +602,14 @@ async function connectGuiPanel(panelIndex) {
     
     try {
         // This creates the display on-demand if it doesn't exist
-        const response = await fetch('/api/x11/panel/' + panelIndex + '/connect', {
+        const response = await fetch('/api/x11/panel/' + panelIndex + '/connect?stream=1', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ width: 1280, height: 800 })
         });
-        const data = await response.json();
+        const data = await readDisplayStream(response, (step) => {
+            body.innerHTML = '<div style="color: var(--text-muted);">Starting ' + step + '...</div>';
+        });
         
         if (data.status === 'error') {
             if (data.message.includes('Missing dependencies')) {